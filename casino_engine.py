@@ -0,0 +1,1137 @@
+"""Game rules and offline tools for the Paradox casino bot, importable without Discord, Flask or the database.
+
+Run `python casino_engine.py bench-rank [users]` to time the rank index,
+`python casino_engine.py bench-poker [hands]` to check and time the poker evaluator, or
+`python casino_engine.py simulate [games...]` for Monte Carlo RTP figures per game.
+"""
+import argparse
+import asyncio
+import bisect
+import concurrent.futures
+import csv
+import itertools
+import json
+import math
+import random
+import sys
+import time
+from array import array
+from collections import namedtuple
+try:
+    import numpy as np  # Optional: vectorizes the batch engines; the pure-Python paths give identical results
+except ImportError:
+    np = None
+
+# --- Game Constants ---
+MAX_LINES = 3
+JACKPOT_SYMBOL = '7️⃣'
+JACKPOT_MULTIPLIER = 5
+SLOTS = ['🍒', '🍋', '🍇', '🔔', '💎', '7️⃣']
+
+RED_NUMBERS = [1, 3, 5, 7, 9, 12, 14, 16, 18, 19, 21, 23, 25, 27, 30, 32, 34, 36]
+BLACK_NUMBERS = [2, 4, 6, 8, 10, 11, 13, 15, 17, 20, 22, 24, 26, 28, 29, 31, 33, 35]
+GREEN_NUMBERS = [0]
+ROULETTE_BETS = {
+    "number": {"payout": 35, "validator": lambda x: x.isdigit() and 0 <= int(x) <= 36},
+    "color": {"payout": 1, "validator": lambda x: x.lower() in ["red", "black"]},
+    "parity": {"payout": 1, "validator": lambda x: x.lower() in ["even", "odd"]}
+}
+
+CARD_SUITS = ['♠', '♣', '♥', '♦']
+CARD_RANKS = ['2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K', 'A']
+POKER_PAYOUTS = {
+    "royal_flush": 250, "straight_flush": 50, "four_of_a_kind": 25, "full_house": 9,
+    "flush": 6, "straight": 4, "three_of_a_kind": 3, "two_pair": 2, "pair": 1, "high_card": 0
+}
+
+BLACKJACK_PAYOUT = 1.5
+WHEEL_PRIZES = [0, 50, 100, 200, 500, 1000, "Jackpot"]
+SCRATCH_PRIZES = [0, 10, 25, 50, 100, 500]
+SCRATCH_PRICE = 20
+TREASURE_HUNT_OUTCOMES = ["Nothing", "Small Chest", "Medium Chest", "Large Chest", "Legendary Treasure"]
+TREASURE_HUNT_WEIGHTS = [0.5, 0.3, 0.15, 0.04, 0.01]
+TREASURE_HUNT_MULTIPLIERS = {"Nothing": 0, "Small Chest": 2, "Medium Chest": 5, "Large Chest": 10, "Legendary Treasure": 50}
+
+# --- Batch Slot Engine ---
+SLOT_LINE_PAYOUT = 100          # Paid per line of three matching symbols (times JACKPOT_MULTIPLIER for the jackpot symbol)
+SLOT_INDEX = {symbol: i for i, symbol in enumerate(SLOTS)}
+JACKPOT_INDEX = SLOT_INDEX[JACKPOT_SYMBOL]
+SPLITMIX_GAMMA = 0x9E3779B97F4A7C15
+MASK64 = (1 << 64) - 1
+SlotBatch = namedtuple('SlotBatch', 'stops line_wins payouts jackpots')
+
+def splitmix64(x):
+    """SplitMix64 output for state x; the pure-Python twin of the NumPy version in slot_stops."""
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9 & MASK64
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EB & MASK64
+    return x ^ (x >> 31)
+
+def splitmix64_array(seed, positions):
+    """NumPy splitmix64 of seed + (position + 1) * gamma over a uint64 array of stream positions."""
+    with np.errstate(over='ignore'):
+        x = (positions + np.uint64(1)) * np.uint64(SPLITMIX_GAMMA) + np.uint64(seed & MASK64)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        x ^= x >> np.uint64(31)
+    return x
+
+def slot_stops(spins, lines, seed, offset=0, use_numpy=None):
+    """Reel stops (symbol indexes) for `spins` spins of `lines` lines, shape (spins, lines, 3).
+
+    Stop k of the stream is SplitMix64 of seed + (offset + k + 1) * gamma, scaled onto the reel, so
+    both backends give identical stops for a seed and any chunk of a stream can be generated on its own.
+    Returns a NumPy array when NumPy is used, else nested lists.
+    """
+    count = spins * lines * 3
+    reel = len(SLOTS)
+    if use_numpy is None:
+        use_numpy = np is not None
+    if use_numpy:
+        x = splitmix64_array(seed, np.arange(offset, offset + count, dtype=np.uint64))
+        stops = ((x >> np.uint64(32)) * np.uint64(reel)) >> np.uint64(32)
+        return stops.astype(np.int8).reshape(spins, lines, 3)
+    stream = [((splitmix64((seed + (offset + k + 1) * SPLITMIX_GAMMA) & MASK64) >> 32) * reel) >> 32
+              for k in range(count)]
+    return [[stream[(s * lines + l) * 3:(s * lines + l) * 3 + 3] for l in range(lines)] for s in range(spins)]
+
+def evaluate_slots(stops):
+    """Score reel stops from slot_stops: SlotBatch of per-line wins, per-spin payouts and jackpot flags."""
+    if np is not None and isinstance(stops, np.ndarray):
+        first = stops[..., 0]
+        matched = (first == stops[..., 1]) & (first == stops[..., 2])
+        jackpot_lines = matched & (first == JACKPOT_INDEX)
+        line_wins = np.where(jackpot_lines, SLOT_LINE_PAYOUT * JACKPOT_MULTIPLIER, np.where(matched, SLOT_LINE_PAYOUT, 0))
+        return SlotBatch(stops, line_wins, line_wins.sum(axis=1), jackpot_lines.any(axis=1))
+    line_wins = [[(SLOT_LINE_PAYOUT * (JACKPOT_MULTIPLIER if a == JACKPOT_INDEX else 1) if a == b == c else 0)
+                  for a, b, c in spin] for spin in stops]
+    jackpots = [any(a == b == c == JACKPOT_INDEX for a, b, c in spin) for spin in stops]
+    return SlotBatch(stops, line_wins, [sum(wins) for wins in line_wins], jackpots)
+
+def spin_batch(spins, lines, seed=None, offset=0, use_numpy=None):
+    """Spin and score `spins` spins of `lines` lines in one go (autoplay, tournaments, RTP runs)."""
+    if seed is None:
+        seed = random.getrandbits(64)
+    return evaluate_slots(slot_stops(spins, lines, seed, offset, use_numpy))
+
+def spin_slots(lines):
+    """Generate slot machine results."""
+    stops = slot_stops(1, lines, random.getrandbits(64), use_numpy=False)[0]
+    return [[SLOTS[i] for i in line] for line in stops]
+
+def check_win(slots):
+    """Check slot machine results for winnings."""
+    batch = evaluate_slots([[[SLOT_INDEX[symbol] for symbol in line] for line in slots]])
+    winning_lines = [(i, win) for i, win in enumerate(batch.line_wins[0]) if win]
+    return batch.payouts[0], batch.jackpots[0], winning_lines
+
+def format_slot_display(slots, winning_lines):
+    """Format the slot display for output."""
+    winning_dict = dict(winning_lines)
+    display = []
+    for i, line in enumerate(slots):
+        if i in winning_dict:
+            display.append(f"▶️ {' '.join(line)} ◀️ +${winning_dict[i]}")
+        else:
+            display.append(f"   {' '.join(line)}")
+    return '\n'.join(display)
+
+def get_roulette_color(number):
+    """Determine the color of a roulette number."""
+    if number in RED_NUMBERS:
+        return "red"
+    elif number in BLACK_NUMBERS:
+        return "black"
+    else:
+        return "green"
+
+def validate_roulette_bet(bet_type, bet_value):
+    """Validate roulette bet type and value."""
+    if bet_type not in ROULETTE_BETS:
+        return False
+    return ROULETTE_BETS[bet_type]["validator"](bet_value)
+
+def calculate_roulette_payout(bet_type, bet_value, spun_number):
+    """Calculate roulette payout based on bet."""
+    color = get_roulette_color(spun_number)
+    if bet_type == "number":
+        return ROULETTE_BETS[bet_type]["payout"] if spun_number == int(bet_value) else 0
+    elif bet_type == "color":
+        return ROULETTE_BETS[bet_type]["payout"] if color == bet_value.lower() else 0
+    elif bet_type == "parity":
+        if spun_number == 0:
+            return 0
+        return ROULETTE_BETS[bet_type]["payout"] if (spun_number % 2 == 0) == (bet_value.lower() == "even") else 0
+    elif bet_type == "range":
+        if spun_number == 0:
+            return 0
+        return ROULETTE_BETS[bet_type]["payout"] if (spun_number > 18) == (bet_value.lower() == "high") else 0
+    elif bet_type == "dozen":
+        ranges = {"first": range(1, 13), "second": range(13, 25), "third": range(25, 37)}
+        return ROULETTE_BETS[bet_type]["payout"] if spun_number in ranges[bet_value.lower()] else 0
+    elif bet_type == "column":
+        column = int(bet_value)
+        return ROULETTE_BETS[bet_type]["payout"] if spun_number % 3 == column - 1 else 0
+    return 0
+
+# --- Cards and Shoes ---
+# A card is an int 0-51: rank index (CARD_RANKS) * 4 + suit index (CARD_SUITS). Games deal, score and keep
+# ints; format_cards turns them into "A♠" strings only when a hand is displayed.
+SHOE_DECKS = 4              # Decks per shoe
+SHOE_PENETRATION = 0.0      # Fraction of a shoe dealt before it is reshuffled; 0 reshuffles before every hand
+CARD_IDS = {f"{rank}{suit}": r * 4 + s for r, rank in enumerate(CARD_RANKS) for s, suit in enumerate(CARD_SUITS)}
+CARD_NAMES = [f"{CARD_RANKS[card >> 2]}{CARD_SUITS[card & 3]}" for card in range(52)]
+BLACKJACK_CARD_VALUES = [min((card >> 2) + 2, 10) if card >> 2 < 12 else 1 for card in range(52)]  # Aces count 1 here
+BACCARAT_CARD_VALUES = [(card >> 2) + 2 if card >> 2 < 8 else 1 if card >> 2 == 12 else 0 for card in range(52)]
+card_shoes = {}  # Game name -> Shoe, for games that deal a whole hand without awaiting
+
+class Shoe:
+    """A multi-deck shoe of card ints dealt with a partial Fisher-Yates shuffle.
+
+    Each draw swaps a random undealt card into place, so dealing costs O(cards drawn). Any arrangement is
+    a valid start for the next partial shuffle, so reshuffling just returns the dealt cards to the shoe.
+    """
+
+    def __init__(self, decks=SHOE_DECKS, penetration=SHOE_PENETRATION, rng=random):
+        self.cards = array('B', range(52)) * decks
+        self.dealt = 0
+        self.cut = int(len(self.cards) * penetration)
+        self.rng = rng
+
+    def shuffle(self):
+        """Return every dealt card to the shoe."""
+        self.dealt = 0
+
+    def start_hand(self):
+        """Reshuffle once the cut card has come out; call before dealing each hand."""
+        if self.dealt >= self.cut:
+            self.shuffle()
+
+    def draw(self, count=1):
+        """Deal `count` cards as a list of ints, reshuffling first if the shoe would run out mid-hand."""
+        cards, start = self.cards, self.dealt
+        if start + count > len(cards):
+            self.shuffle()
+            start = 0
+        randrange, size = self.rng.randrange, len(cards)
+        for i in range(start, start + count):
+            j = randrange(i, size)
+            cards[i], cards[j] = cards[j], cards[i]
+        self.dealt = start + count
+        return cards[start:start + count].tolist()
+
+def get_shoe(game):
+    """The shared shoe for a game whose hands are dealt in one go (no await between draws)."""
+    shoe = card_shoes.get(game)
+    if shoe is None:
+        shoe = card_shoes[game] = Shoe()
+    return shoe
+
+def format_cards(cards):
+    """Render card ints for display, e.g. "A♠ 10♥"."""
+    return ' '.join(CARD_NAMES[card] for card in cards)
+
+# --- Poker Hand Evaluator ---
+# Every 5-card hand of card ints (see Cards and Shoes) has one of 7462 strength values (1 = 7-5-4-3-2 offsuit ... 7462 = royal flush), read from three tables: flushes by
+# rank bitmask, hands of five distinct ranks by rank bitmask, and hands with a repeated rank by the product
+# of per-rank primes, which is unique to the rank multiset.
+HAND_CATEGORIES = ('high_card', 'pair', 'two_pair', 'three_of_a_kind', 'straight', 'flush',
+                   'full_house', 'four_of_a_kind', 'straight_flush')
+RANK_PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+STRAIGHT_MASKS = [0b1000000001111] + [0b11111 << (top - 4) for top in range(4, 13)]  # Wheel first, broadway last
+CARD_BITS = [1 << (card >> 2) for card in range(52)]
+CARD_PRIMES = [RANK_PRIMES[card >> 2] for card in range(52)]
+POKER_HAND_COUNTS = {  # Single-deck 5-card hands per category, for check_poker_evaluator
+    'high_card': 1302540, 'pair': 1098240, 'two_pair': 123552, 'three_of_a_kind': 54912, 'straight': 10200,
+    'flush': 5108, 'full_house': 3744, 'four_of_a_kind': 624, 'straight_flush': 40
+}
+seven_card_values = None  # Rank-multiset product -> best non-flush value for 6 and 7 cards, built on first use
+
+def build_poker_tables():
+    """Number every 5-card hand class from weakest to strongest and index it by bitmask or prime product.
+
+    Returns (flush_values, unique_values, product_values, category_floors, payout_names). flush_values also
+    holds the best flush in every 6- and 7-rank mask so best_hand_value can read suited Hold'em hands directly.
+    """
+    flush_values = [0] * (1 << 13)
+    unique_values = [0] * (1 << 13)
+    product_values = {}
+    payout_names = [None]
+    floors = []
+    plain = sorted(mask for mask in range(1 << 13) if bin(mask).count('1') == 5 and mask not in STRAIGHT_MASKS)
+
+    def add(category, name=None):
+        payout_names.append(name or category)
+        return len(payout_names) - 1
+
+    def kickers(count, *used):
+        return sorted(mask for mask in range(1 << 13) if bin(mask).count('1') == count and not mask & sum(1 << r for r in used))
+
+    def product(ranks, mask=0):
+        result = math.prod(RANK_PRIMES[r] for r in ranks)
+        return result * math.prod(RANK_PRIMES[r] for r in range(13) if mask >> r & 1)
+
+    floors.append(1)
+    for mask in plain:
+        unique_values[mask] = add('high_card')
+    floors.append(len(payout_names))
+    for pair in range(13):
+        for mask in kickers(3, pair):
+            product_values[product((pair, pair), mask)] = add('pair', 'pair' if pair >= 9 else 'high_card')  # Jacks or better
+    floors.append(len(payout_names))
+    for high in range(13):
+        for low in range(high):
+            for kicker in range(13):
+                if kicker not in (high, low):
+                    product_values[product((high, high, low, low, kicker))] = add('two_pair')
+    floors.append(len(payout_names))
+    for trips in range(13):
+        for mask in kickers(2, trips):
+            product_values[product((trips,) * 3, mask)] = add('three_of_a_kind')
+    floors.append(len(payout_names))
+    for mask in STRAIGHT_MASKS:
+        unique_values[mask] = add('straight')
+    floors.append(len(payout_names))
+    for mask in plain:
+        flush_values[mask] = add('flush')
+    floors.append(len(payout_names))
+    for trips in range(13):
+        for pair in range(13):
+            if pair != trips:
+                product_values[product((trips,) * 3 + (pair,) * 2)] = add('full_house')
+    floors.append(len(payout_names))
+    for quads in range(13):
+        for kicker in range(13):
+            if kicker != quads:
+                product_values[product((quads,) * 4 + (kicker,))] = add('four_of_a_kind')
+        # Five of a kind only comes out of a multi-deck shoe; it pays as the best quads of that rank
+        product_values[RANK_PRIMES[quads] ** 5] = product_values[product((quads,) * 4 + (12 if quads < 12 else 11,))]
+    floors.append(len(payout_names))
+    for mask in STRAIGHT_MASKS:
+        flush_values[mask] = add('straight_flush')
+    payout_names[-1] = 'royal_flush'
+
+    for size in (6, 7):
+        for mask in range(1 << 13):
+            if bin(mask).count('1') == size:
+                flush_values[mask] = max(flush_values[mask & ~(1 << r)] for r in range(13) if mask >> r & 1)
+    return flush_values, unique_values, product_values, floors, payout_names
+
+FLUSH_VALUES, UNIQUE_VALUES, PRODUCT_VALUES, HAND_CATEGORY_FLOORS, POKER_PAYOUT_NAMES = build_poker_tables()
+
+def hand_value(cards):
+    """Strength (1-7462, higher wins) of five card ints.
+
+    Hands from a multi-deck shoe may repeat a card: a suited hand with a repeated rank counts as the weakest
+    flush unless its ranks make a full house or better, and five of a kind counts as quads.
+    """
+    a, b, c, d, e = cards
+    bits = CARD_BITS[a] | CARD_BITS[b] | CARD_BITS[c] | CARD_BITS[d] | CARD_BITS[e]
+    if a & 3 == b & 3 == c & 3 == d & 3 == e & 3:
+        value = FLUSH_VALUES[bits]
+        if value:
+            return value
+        return max(PRODUCT_VALUES[CARD_PRIMES[a] * CARD_PRIMES[b] * CARD_PRIMES[c] * CARD_PRIMES[d] * CARD_PRIMES[e]],
+                   HAND_CATEGORY_FLOORS[5])
+    value = UNIQUE_VALUES[bits]
+    if value:
+        return value
+    return PRODUCT_VALUES[CARD_PRIMES[a] * CARD_PRIMES[b] * CARD_PRIMES[c] * CARD_PRIMES[d] * CARD_PRIMES[e]]
+
+def hand_category(value):
+    """HAND_CATEGORIES name of a hand_value."""
+    return HAND_CATEGORIES[bisect.bisect_right(HAND_CATEGORY_FLOORS, value) - 1]
+
+def get_seven_card_values():
+    """Best non-flush value of every 6- and 7-card rank multiset, keyed by prime product.
+
+    Each multiset's best hand is the best over dropping one rank, so the table builds up from the 5-card
+    values without enumerating 21 sub-hands per entry.
+    """
+    global seven_card_values
+    if seven_card_values is None:
+        values = dict(PRODUCT_VALUES)
+        for mask in range(1 << 13):
+            if UNIQUE_VALUES[mask]:
+                values[math.prod(RANK_PRIMES[r] for r in range(13) if mask >> r & 1)] = UNIQUE_VALUES[mask]
+        previous = values
+        for size in (6, 7):
+            current = {}
+            for ranks in itertools.combinations_with_replacement(range(13), size):
+                if any(ranks[i] == ranks[i + 4] for i in range(size - 4)):
+                    continue  # More than four of a rank is not in a single deck
+                key = math.prod(RANK_PRIMES[r] for r in ranks)
+                current[key] = max(previous[key // RANK_PRIMES[r]] for r in set(ranks))
+            values.update(current)
+            previous = current
+        seven_card_values = values
+    return seven_card_values
+
+def best_hand_value(cards):
+    """Strength of the best 5-card hand in 5-7 distinct card ints (e.g. Hold'em hole cards plus board)."""
+    if len(cards) == 5:
+        return hand_value(cards)
+    suit_bits = [0, 0, 0, 0]
+    product = 1
+    for card in cards:
+        suit_bits[card & 3] |= CARD_BITS[card]
+        product *= CARD_PRIMES[card]
+    for bits in suit_bits:
+        if FLUSH_VALUES[bits]:
+            return FLUSH_VALUES[bits]  # With five or more suited cards nothing but a straight flush beats the flush
+    return (seven_card_values or get_seven_card_values())[product]
+
+def check_poker_evaluator():
+    """Evaluate all 2,598,960 single-deck 5-card hands; True if every category count and class total matches."""
+    counts = dict.fromkeys(HAND_CATEGORIES, 0)
+    seen = set()
+    for hand in itertools.combinations(range(52), 5):
+        value = hand_value(hand)
+        seen.add(value)
+        counts[hand_category(value)] += 1
+    for category in HAND_CATEGORIES:
+        print(f"{category:>16}: {counts[category]:>9} (expected {POKER_HAND_COUNTS[category]})")
+    print(f"{len(seen)} distinct hand classes (expected 7462)")
+    return counts == POKER_HAND_COUNTS and len(seen) == len(POKER_PAYOUT_NAMES) - 1 == 7462
+
+def bench_poker_evaluator(hands=1_000_000):
+    """Check the evaluator exhaustively, then time 5-card, card-string and 7-card evaluation."""
+    start = time.perf_counter()
+    ok = check_poker_evaluator()
+    print(f"exhaustive check {'passed' if ok else 'FAILED'}: {time.perf_counter() - start:.2f}s")
+    rng = random.Random(0)
+    deals = [rng.sample(range(52), 7) for _ in range(hands)]
+    fives = [deal[:5] for deal in deals]
+    start = time.perf_counter()
+    for hand in fives:
+        hand_value(hand)
+    elapsed = time.perf_counter() - start
+    print(f"{hands} 5-card hands: {elapsed:.2f}s ({hands / elapsed / 1e6:.2f}M hands/s)")
+    deals_only = min(hands, 100_000)
+    start = time.perf_counter()
+    for _ in range(deals_only):
+        evaluate_poker_hand(deal_poker_hand())
+    elapsed = time.perf_counter() - start
+    print(f"{deals_only} shoe deals + evaluate_poker_hand: {elapsed:.2f}s ({elapsed / deals_only * 1e6:.2f} us each)")
+    start = time.perf_counter()
+    get_seven_card_values()
+    print(f"7-card table: {len(seven_card_values)} entries in {time.perf_counter() - start:.2f}s")
+    start = time.perf_counter()
+    for deal in deals:
+        best_hand_value(deal)
+    elapsed = time.perf_counter() - start
+    print(f"{hands} 7-card hands: {elapsed:.2f}s ({hands / elapsed / 1e6:.2f}M hands/s)")
+    return ok
+
+def deal_poker_hand():
+    """Deal a 5-card poker hand."""
+    shoe = get_shoe('poker')
+    shoe.start_hand()
+    return shoe.draw(5)
+
+def evaluate_poker_hand(hand):
+    """Evaluate a poker hand and return the best combination."""
+    return POKER_PAYOUT_NAMES[hand_value(hand)]
+
+def roll_dice(n=2, rng=random):
+    """Roll n dice and return the sum."""
+    return sum(rng.randint(1, 6) for _ in range(n))
+
+def baccarat_hand(cards):
+    """Calculate the value of a Baccarat hand."""
+    return sum(BACCARAT_CARD_VALUES[card] for card in cards) % 10
+
+def generate_bingo_card():
+    """Generate a 5x5 bingo card."""
+    card = []
+    for col, letter in enumerate('BINGO'):
+        if letter == 'N':
+            numbers = random.sample(range(col * 15 + 1, col * 15 + 16), 4)
+            card.append(numbers[:2] + [None] + numbers[2:])
+        else:
+            card.append(random.sample(range(col * 15 + 1, col * 15 + 16), 5))
+    return list(zip(*card))
+
+def check_bingo_win(card, called_numbers):
+    """Check if a bingo card has a winning line."""
+    for row in card:
+        if all(num in called_numbers for num in row if num is not None):
+            return True
+    for col in zip(*card):
+        if all(num in called_numbers for num in col if num is not None):
+            return True
+    if all(card[i][i] in called_numbers for i in range(5) if card[i][i] is not None):
+        return True
+    if all(card[i][4 - i] in called_numbers for i in range(5) if card[i][4 - i] is not None):
+        return True
+    return False
+
+# --- Blackjack Engine ---
+# !blackjack deals from a persistent shoe per channel and keeps hand totals incrementally. Dealer outcome
+# odds, the EV of hitting or standing and the basic-strategy hit table are computed once at import for
+# this table's rules (dealer stands on all 17s, no doubling or splitting, infinite-deck card odds).
+BLACKJACK_PENETRATION = 0.75    # Share of a table's shoe dealt before the cut card brings a reshuffle
+DEALER_STANDS_ON = 17
+BLACKJACK_MAX_CARDS = 32        # Most cards one round can take from a shoe of up to six decks (low cards run out first)
+BLACKJACK_BATCH_BLOCK = 8192   # Rounds per NumPy block in blackjack_batch; keeps the block's shoes (~1.7 MB) in cache
+BLACKJACK_SHOE_VALUES = [BLACKJACK_CARD_VALUES[card] for card in range(52)] * SHOE_DECKS
+CARD_VALUE_ODDS = [(value, (4 if value == 10 else 1) / 13) for value in range(1, 11)]  # Aces count 1
+blackjack_tables = {}  # Channel id -> BlackjackTable
+
+class BlackjackHand:
+    """Cards plus a running hard total (aces count 1) and whether an ace is held, so a draw is O(1)."""
+    __slots__ = ('cards', 'total', 'soft')
+
+    def __init__(self):
+        self.cards = []
+        self.total = 0
+        self.soft = False
+
+    def deal(self, shoe, count=1):
+        for card in shoe.draw(count):
+            self.cards.append(card)
+            self.total += BLACKJACK_CARD_VALUES[card]
+            self.soft = self.soft or card >> 2 == 12
+
+    @property
+    def value(self):
+        return self.total + 10 if self.soft and self.total <= 11 else self.total
+
+    @property
+    def natural(self):
+        return len(self.cards) == 2 and self.value == 21
+
+class BlackjackTable:
+    """A channel's table: one shoe shared by every hand there, reshuffled only while no hand is open."""
+
+    def __init__(self):
+        self.shoe = Shoe(penetration=BLACKJACK_PENETRATION)
+        self.hands = 0
+
+    def open_hand(self):
+        if not self.hands:
+            self.shoe.start_hand()
+        self.hands += 1
+        return self.shoe
+
+    def close_hand(self):
+        self.hands -= 1
+
+def get_blackjack_table(channel_id):
+    """The channel's BlackjackTable, created on first use."""
+    table = blackjack_tables.get(channel_id)
+    if table is None:
+        table = blackjack_tables[channel_id] = BlackjackTable()
+    return table
+
+def build_blackjack_tables():
+    """Dealer final-total odds per upcard, stand/hit EVs and the basic-strategy hit table.
+
+    Returns (dealer_odds, stand_ev, hit_ev, hit_table): dealer_odds[up] is the chance of finishing on
+    17, 18, 19, 20, 21 or busting; stand_ev[up][value]; hit_ev[soft][total][up] and hit_table[soft][total][up]
+    are indexed by hard total and whether an ace is held. Upcards are blackjack values, ace = 1.
+    """
+    finals = {}
+
+    def dealer(total, soft):
+        if (total, soft) not in finals:
+            value = total + 10 if soft and total <= 11 else total
+            odds = [0.0] * 6
+            if value >= DEALER_STANDS_ON:
+                odds[5 if value > 21 else value - 17] = 1.0
+            else:
+                for card, chance in CARD_VALUE_ODDS:
+                    for i, p in enumerate(dealer(total + card, soft or card == 1)):
+                        odds[i] += chance * p
+            finals[total, soft] = odds
+        return finals[total, soft]
+
+    dealer_odds = [None] + [dealer(up, up == 1) for up in range(1, 11)]
+    stand_ev = [None] + [[-1.0 if value > 21 else odds[5] + sum(odds[:max(0, value - 17)]) - sum(odds[max(0, value - 16):5])
+                          for value in range(32)] for odds in dealer_odds[1:]]
+    hit_ev = [[[None] * 11 for _ in range(32)] for _ in range(2)]
+
+    def hit(total, soft, up):
+        if hit_ev[soft][total][up] is None:
+            ev = 0.0
+            for card, chance in CARD_VALUE_ODDS:
+                new_total, new_soft = total + card, soft or card == 1
+                value = new_total + 10 if new_soft and new_total <= 11 else new_total
+                ev += chance * (-1.0 if value > 21 else max(stand_ev[up][value], hit(new_total, new_soft, up)))
+            hit_ev[soft][total][up] = ev
+        return hit_ev[soft][total][up]
+
+    hit_table = [[[False] * 11 for _ in range(32)] for _ in range(2)]
+    for soft in (0, 1):
+        for total in range(2, 22):
+            value = total + 10 if soft and total <= 11 else total
+            for up in range(1, 11):
+                hit_table[soft][total][up] = value < 21 and hit(total, soft, up) > stand_ev[up][value]
+    return dealer_odds, stand_ev, hit_ev, hit_table
+
+DEALER_FINAL_ODDS, BLACKJACK_STAND_EV, BLACKJACK_HIT_EV, BLACKJACK_HIT = build_blackjack_tables()
+
+def blackjack_hint(hand, upcard):
+    """Basic-strategy advice for a BlackjackHand against the dealer's upcard, with both EVs per unit bet."""
+    up = BLACKJACK_CARD_VALUES[upcard]
+    stand = BLACKJACK_STAND_EV[up][hand.value]
+    hit = BLACKJACK_HIT_EV[hand.soft][hand.total][up]
+    action = "Hit" if BLACKJACK_HIT[hand.soft][hand.total][up] else "Stand"
+    return f"{action} (EV hit {hit:+.2f}, stand {stand:+.2f})"
+
+def blackjack_policy(policy):
+    """Hit table for blackjack_batch: 'basic' for BLACKJACK_HIT, or a total the player hits below."""
+    if policy == 'basic':
+        return BLACKJACK_HIT
+    return [[[(total + 10 if soft and total <= 11 else total) < min(policy, 21)] * 11 for total in range(32)]
+            for soft in (0, 1)]
+
+def blackjack_batch(rounds, amount=100, seed=None, offset=0, policy='basic', use_numpy=None):
+    """Play `rounds` independent !blackjack rounds; returns what each round paid back (stake included).
+
+    Every round deals from its own fresh shoe by partial Fisher-Yates, card i of round h using stream
+    position offset + h * BLACKJACK_MAX_CARDS + i, so both backends play identical rounds for a seed. The
+    NumPy backend plays a block of rounds per vectorized step; `policy` is 'basic' or a hit-below total.
+    """
+    if seed is None:
+        seed = random.getrandbits(64)
+    if use_numpy is None:
+        use_numpy = np is not None
+    hit_table = blackjack_policy(policy)
+    if not use_numpy:
+        return [play_blackjack_round(amount, seed, offset + h * BLACKJACK_MAX_CARDS, hit_table) for h in range(rounds)]
+    hit_table = np.array(hit_table, dtype=bool)
+    blocks = [blackjack_block(min(BLACKJACK_BATCH_BLOCK, rounds - first), amount, seed,
+                              offset + first * BLACKJACK_MAX_CARDS, hit_table)
+              for first in range(0, rounds, BLACKJACK_BATCH_BLOCK)]
+    return np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.int64)
+
+def play_blackjack_round(amount, seed, base, hit_table):
+    """Pure-Python twin of blackjack_block for one round whose cards start at stream position base."""
+    shoe = list(BLACKJACK_SHOE_VALUES)
+    size = len(shoe)
+    drawn = 0
+
+    def draw():
+        nonlocal drawn
+        x = splitmix64((seed + (base + drawn + 1) * SPLITMIX_GAMMA) & MASK64)
+        j = drawn + (((x >> 32) * (size - drawn)) >> 32)
+        shoe[drawn], shoe[j] = shoe[j], shoe[drawn]
+        drawn += 1
+        return shoe[drawn - 1]
+
+    first, second, up, hole = draw(), draw(), draw(), draw()
+    total, soft, cards = first + second, first == 1 or second == 1, 2
+    dealer_total, dealer_soft = up + hole, up == 1 or hole == 1
+    while hit_table[soft][total][up]:
+        card = draw()
+        total, soft, cards = total + card, soft or card == 1, cards + 1
+    value = total + 10 if soft and total <= 11 else total
+    if value > 21:
+        return 0
+    dealer_value = dealer_total + 10 if dealer_soft and dealer_total <= 11 else dealer_total
+    while dealer_value < DEALER_STANDS_ON:
+        card = draw()
+        dealer_total, dealer_soft = dealer_total + card, dealer_soft or card == 1
+        dealer_value = dealer_total + 10 if dealer_soft and dealer_total <= 11 else dealer_total
+    if dealer_value > 21 or value > dealer_value:
+        return amount + int(amount * (BLACKJACK_PAYOUT if value == 21 and cards == 2 else 1))
+    return amount if value == dealer_value else 0
+
+def blackjack_block(rounds, amount, seed, offset, hit_table):
+    """Play one block of rounds with NumPy; Fisher-Yates steps run only as far as some round has drawn."""
+    size = len(BLACKJACK_SHOE_VALUES)
+    shoes = np.tile(np.array(BLACKJACK_SHOE_VALUES, dtype=np.int8), rounds)  # Flat: round h's shoe starts at h * size
+    rows = np.arange(rounds)
+    row_start = rows * size
+    base = np.uint64(offset) + rows.astype(np.uint64) * np.uint64(BLACKJACK_MAX_CARDS)
+    shuffled = 0
+
+    def reveal(upto):
+        nonlocal shuffled
+        for i in range(shuffled, upto + 1):
+            x = splitmix64_array(seed, base + np.uint64(i))
+            here = row_start + i
+            there = here + ((x >> np.uint64(32)) * np.uint64(size - i) >> np.uint64(32)).astype(np.intp)
+            shoes[here], shoes[there] = shoes[there], shoes[here]
+        shuffled = max(shuffled, upto + 1)
+
+    reveal(3)
+    first, second, up, hole = (shoes[row_start + i].astype(np.int64) for i in range(4))
+    total, soft = first + second, (first == 1) | (second == 1)
+    dealer_total, dealer_soft = up + hole, (up == 1) | (hole == 1)
+    position = np.full(rounds, 4)
+    cards = np.full(rounds, 2)
+    while True:
+        hitting = hit_table[soft.astype(np.intp), total, up]
+        if not hitting.any():
+            break
+        reveal(int(position[hitting].max()))
+        card = shoes[row_start + position].astype(np.int64)
+        total += card * hitting
+        soft |= hitting & (card == 1)
+        position += hitting
+        cards += hitting
+    value = total + 10 * (soft & (total <= 11))
+    alive = value <= 21
+    while True:
+        dealer_value = dealer_total + 10 * (dealer_soft & (dealer_total <= 11))
+        drawing = alive & (dealer_value < DEALER_STANDS_ON)
+        if not drawing.any():
+            break
+        reveal(int(position[drawing].max()))
+        card = shoes[row_start + position].astype(np.int64)
+        dealer_total += card * drawing
+        dealer_soft |= drawing & (card == 1)
+        position += drawing
+    win = alive & ((dealer_value > 21) | (value > dealer_value))
+    push = alive & (value == dealer_value)
+    natural = (value == 21) & (cards == 2)
+    winnings = np.where(natural, int(amount * BLACKJACK_PAYOUT), amount)
+    return np.where(win, amount + winnings, np.where(push, amount, 0)).astype(np.int64)
+
+# --- Game Simulator ---
+# Offline Monte Carlo of every gambling command's payout rules, for RTP / house-edge checks:
+#   python casino_engine.py simulate [games...] --rounds 10000000 --seed 1
+# The round functions below mirror the settlement in each command.
+SIM_GAMES = ('bet', 'roulette', 'poker', 'blackjack', 'craps', 'baccarat', 'wheel', 'scratch',
+             'treasurehunt', 'paradox', 'slotstreak')
+SIM_CHUNK_ROUNDS = 100_000      # Rounds per worker task; also the unit the seed streams are keyed on
+SIM_Z = 1.959963984540054       # Two-sided 95% normal quantile for the RTP confidence interval
+SIM_DEFAULTS = {
+    'lines': 1, 'mode': 'normal', 'roulette': 'color:red', 'craps': 'pass', 'baccarat': 'banker',
+    'door': 'risky', 'stand_on': None, 'multiplier': 1.0, 'penetration': SHOE_PENETRATION
+}
+SIM_FIELDS = ('game', 'rounds', 'stake', 'rtp', 'house_edge', 'ci_low', 'ci_high', 'variance', 'std_dev',
+              'hit_frequency', 'max_return', 'seed')
+
+def sim_roulette(rng, shoe, amount, options):
+    """One !roulette spin on options['roulette'] ("type:value")."""
+    bet_type, bet_value = options['roulette'].split(':', 1)
+    payout = calculate_roulette_payout(bet_type, bet_value, rng.randint(0, 36))
+    return amount, amount * (1 + payout) if payout > 0 else 0
+
+def sim_poker(rng, shoe, amount, options):
+    """One !poker deal, paid from POKER_PAYOUTS."""
+    shoe.start_hand()
+    return amount, POKER_PAYOUTS[evaluate_poker_hand(shoe.draw(5))] * amount
+
+def sim_craps(rng, shoe, amount, options):
+    """One !craps round on the pass or don't pass line."""
+    pass_line = options['craps'] == 'pass'
+    roll = roll_dice(rng=rng)
+    if roll in (7, 11):
+        win = pass_line
+    elif roll in (2, 3, 12):
+        win = not pass_line
+    else:
+        point = roll
+        roll = roll_dice(rng=rng)
+        while roll not in (point, 7):
+            roll = roll_dice(rng=rng)
+        win = pass_line == (roll == point)
+    return amount, 2 * amount if win else 0
+
+def sim_baccarat(rng, shoe, amount, options):
+    """One !baccarat coup (two cards each) on options['baccarat']."""
+    shoe.start_hand()
+    cards = shoe.draw(4)
+    player_value = baccarat_hand(cards[:2])
+    banker_value = baccarat_hand(cards[2:])
+    bet = options['baccarat']
+    if player_value > banker_value:
+        return amount, 2 * amount if bet == 'player' else 0
+    if banker_value > player_value:
+        return amount, amount + int(amount * 0.95) if bet == 'banker' else 0
+    return amount, 9 * amount if bet == 'tie' else 0
+
+def sim_wheel(rng, shoe, amount, options):
+    """One !wheel spin."""
+    prize = rng.choice(WHEEL_PRIZES)
+    if prize == "Jackpot":
+        return amount, amount * 11
+    return amount, prize if isinstance(prize, int) else 0
+
+def sim_scratch(rng, shoe, amount, options):
+    """One scratch card; the price is always SCRATCH_PRICE."""
+    symbols = [rng.choice(SCRATCH_PRIZES) for _ in range(3)]
+    if symbols[0] == symbols[1] == symbols[2]:
+        return SCRATCH_PRICE, SCRATCH_PRICE + symbols[0] * 3
+    return SCRATCH_PRICE, 0
+
+def sim_treasurehunt(rng, shoe, amount, options):
+    """One !treasurehunt with the double_winnings multiplier in options."""
+    result = rng.choices(TREASURE_HUNT_OUTCOMES, weights=TREASURE_HUNT_WEIGHTS, k=1)[0]
+    return amount, amount + int((amount * TREASURE_HUNT_MULTIPLIERS[result] - amount) * options['multiplier'])
+
+def sim_paradox(rng, shoe, amount, options):
+    """One !paradox through options['door']."""
+    if options['door'] == 'safe':
+        payout = amount
+    else:
+        payout = amount * 2 if rng.random() < 0.5 else -amount
+    return amount, amount + int(payout * options['multiplier'])
+
+SIM_ROUNDS = {
+    'roulette': sim_roulette, 'poker': sim_poker, 'craps': sim_craps,
+    'baccarat': sim_baccarat, 'wheel': sim_wheel, 'scratch': sim_scratch, 'treasurehunt': sim_treasurehunt,
+    'paradox': sim_paradox
+}
+
+def slot_returns(game, start, rounds, seed, amount, options):
+    """Stake and per-round returns of !bet or !slotstreak from one chunk of the batch slot stream."""
+    lines = options['lines'] if game == 'bet' else 1
+    mode_multiplier = 2 if game == 'bet' and options['mode'] == 'high_risk' else 1
+    multiplier = options['multiplier'] if game == 'bet' else 1
+    payouts = spin_batch(rounds, lines, seed, offset=start * lines * 3).payouts
+    stake = amount * lines * mode_multiplier
+    if np is not None and isinstance(payouts, np.ndarray):
+        returns = payouts.astype(np.int64) * mode_multiplier
+        if game == 'slotstreak':
+            # A win extends the streak, a loss resets it; each chunk plays as one session from a zero streak
+            position = np.arange(rounds)
+            last_loss = np.maximum.accumulate(np.where(returns > 0, -1, position))
+            returns = returns * (1 + (position - last_loss) * 0.1)
+        if multiplier != 1:
+            returns = returns * multiplier
+        return stake, returns.astype(np.int64)
+    returns = []
+    streak = 0
+    for payout in payouts:
+        payout *= mode_multiplier
+        if game == 'slotstreak':
+            streak = streak + 1 if payout > 0 else 0
+            payout *= (1 + streak * 0.1)
+        returns.append(int(payout * multiplier))
+    return stake, returns
+
+def simulate_chunk(game, start, rounds, seed, amount, options):
+    """Play rounds [start, start + rounds) of a game: (rounds, staked, returned, returned_sq, hits, max_return).
+
+    Chunk RNGs are keyed on the seed and the chunk's start, so results do not depend on the worker count.
+    """
+    if game in ('bet', 'slotstreak', 'blackjack'):
+        if game == 'blackjack':
+            stake, returns = amount, blackjack_batch(rounds, amount, seed, start * BLACKJACK_MAX_CARDS,
+                                                     options['stand_on'] or 'basic')
+        else:
+            stake, returns = slot_returns(game, start, rounds, seed, amount, options)
+        if np is not None and isinstance(returns, np.ndarray):
+            return (rounds, stake * rounds, int(returns.sum()), int((returns * returns).sum()),
+                    int(np.count_nonzero(returns)), int(returns.max()))
+        return (rounds, stake * rounds, sum(returns), sum(r * r for r in returns),
+                sum(1 for r in returns if r > 0), max(returns))
+    rng = random.Random(splitmix64((seed + (start + 1) * SPLITMIX_GAMMA) & MASK64))
+    play = SIM_ROUNDS[game]
+    shoe = Shoe(penetration=options['penetration'], rng=rng)
+    staked = returned = returned_sq = hits = max_return = 0
+    for _ in range(rounds):
+        stake, payout = play(rng, shoe, amount, options)
+        staked += stake
+        returned += payout
+        returned_sq += payout * payout
+        if payout > 0:
+            hits += 1
+            if payout > max_return:
+                max_return = payout
+    return rounds, staked, returned, returned_sq, hits, max_return
+
+def simulation_report(game, totals, seed):
+    """RTP, house edge, 95% CI, per-unit-stake variance and hit frequency from summed chunk totals."""
+    rounds, staked, returned, returned_sq, hits, max_return = totals
+    stake = staked / rounds
+    rtp = returned / staked
+    variance = (returned_sq * rounds - returned * returned) / (rounds * rounds) / (stake * stake)
+    margin = SIM_Z * math.sqrt(variance / rounds)
+    return {
+        'game': game, 'rounds': rounds, 'stake': stake, 'rtp': rtp, 'house_edge': 1 - rtp,
+        'ci_low': rtp - margin, 'ci_high': rtp + margin, 'variance': variance, 'std_dev': math.sqrt(variance),
+        'hit_frequency': hits / rounds, 'max_return': max_return, 'seed': seed
+    }
+
+def simulate_games(games, rounds, seed=None, amount=100, options=None, workers=None, chunk=SIM_CHUNK_ROUNDS):
+    """Simulate `rounds` rounds of each game across a process pool and return one report per game."""
+    if seed is None:
+        seed = random.getrandbits(64)
+    options = {**SIM_DEFAULTS, **(options or {})}
+    tasks = [(game, start, min(chunk, rounds - start), seed, amount, options)
+             for game in games for start in range(0, rounds, chunk)]
+    if workers == 1:
+        results = [simulate_chunk(*task) for task in tasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(simulate_chunk, *zip(*tasks)))
+    totals = {}
+    for task, result in zip(tasks, results):
+        previous = totals.get(task[0])
+        totals[task[0]] = result if previous is None else (
+            tuple(a + b for a, b in zip(previous[:5], result[:5])) + (max(previous[5], result[5]),))
+    return [simulation_report(game, totals[game], seed) for game in games]
+
+def simulate_cli(argv):
+    """Entry point for `simulate`: parse arguments, run the simulation and write JSON or CSV."""
+    parser = argparse.ArgumentParser(prog='simulate', description="Monte Carlo RTP / house edge of the casino games")
+    parser.add_argument('games', nargs='*', choices=SIM_GAMES + ('all',), default='all')
+    parser.add_argument('--rounds', type=int, default=1_000_000, help="Rounds per game")
+    parser.add_argument('--seed', type=int, default=None, help="Base seed; the same seed reproduces a run")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--chunk', type=int, default=SIM_CHUNK_ROUNDS, help="Rounds per worker task")
+    parser.add_argument('--bet', type=int, default=100, help="Bet per round (scratch always costs SCRATCH_PRICE)")
+    parser.add_argument('--lines', type=int, default=SIM_DEFAULTS['lines'], choices=range(1, MAX_LINES + 1))
+    parser.add_argument('--mode', default=SIM_DEFAULTS['mode'], choices=['normal', 'high_risk'])
+    parser.add_argument('--roulette', default=SIM_DEFAULTS['roulette'], help="Roulette bet as type:value, e.g. number:17")
+    parser.add_argument('--craps', default=SIM_DEFAULTS['craps'], choices=['pass', 'dont_pass'])
+    parser.add_argument('--baccarat', default=SIM_DEFAULTS['baccarat'], choices=['player', 'banker', 'tie'])
+    parser.add_argument('--door', default=SIM_DEFAULTS['door'], choices=['safe', 'risky'])
+    parser.add_argument('--stand-on', type=int, default=SIM_DEFAULTS['stand_on'], help="Blackjack: hit below this total instead of playing basic strategy")
+    parser.add_argument('--penetration', type=float, default=SIM_DEFAULTS['penetration'],
+                        help="Poker and baccarat: fraction of the shoe dealt before a reshuffle (0 = fresh shoe every hand)")
+    parser.add_argument('--multiplier', type=float, default=SIM_DEFAULTS['multiplier'], help="double_winnings event multiplier")
+    parser.add_argument('--format', default='json', choices=['json', 'csv'])
+    parser.add_argument('--output', default=None, help="File to write (default: stdout)")
+    args = parser.parse_args(argv)
+    if args.rounds <= 0 or args.chunk <= 0:
+        parser.error("--rounds and --chunk must be positive")
+    bet_type, _, bet_value = args.roulette.partition(':')
+    if not validate_roulette_bet(bet_type, bet_value):
+        parser.error(f"invalid roulette bet: {args.roulette}")
+    games = SIM_GAMES if 'all' in args.games else tuple(dict.fromkeys(args.games))
+    options = {'lines': args.lines, 'mode': args.mode, 'roulette': args.roulette, 'craps': args.craps,
+               'baccarat': args.baccarat, 'door': args.door, 'stand_on': args.stand_on, 'multiplier': args.multiplier,
+               'penetration': args.penetration}
+
+    started = time.perf_counter()
+    reports = simulate_games(games, args.rounds, args.seed, args.bet, options, args.workers, args.chunk)
+    print(f"Simulated {args.rounds:,} rounds x {len(games)} games in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        if args.format == 'csv':
+            writer = csv.DictWriter(out, fieldnames=SIM_FIELDS)
+            writer.writeheader()
+            writer.writerows(reports)
+        else:
+            json.dump(reports, out, indent=2)
+            out.write('\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+# --- Rank Index ---
+RANK_BLOCK_SIZE = 512       # Keys per block of a RankIndex; blocks split at twice this
+RANK_AROUND = 2             # Players shown above and below you by !rank
+RANK_KEY_SHIFT = 64         # Discord ids fit in 64 bits, so (score, id) packs into one int
+
+def rank_key(score, user_id):
+    """Pack (score, user_id) into one int that sorts by score, then id."""
+    return (score << RANK_KEY_SHIFT) | user_id
+
+def unpack_rank_key(key):
+    return key & ((1 << RANK_KEY_SHIFT) - 1), key >> RANK_KEY_SHIFT
+
+class RankIndex:
+    """Every player's score for one metric and scope, kept sorted for rank and neighbour lookups.
+
+    Keys live in sorted blocks of about RANK_BLOCK_SIZE with a Fenwick tree over the block sizes, so
+    finding a key's position, or the key at a position, takes a bisect over block maxima plus a
+    Fenwick walk, and an update only shifts one block.
+    """
+
+    def __init__(self):
+        self.blocks = []
+        self.maxes = []
+        self.tree = []
+        self.size = 0
+        self.loaded = False
+        self.loading = False
+        self.pending = {}  # user_id -> every score seen for them while a reload was reading
+        self.lock = asyncio.Lock()
+
+    def build(self, keys):
+        """Replace the contents with `keys` (any order)."""
+        keys = sorted(keys)
+        self.blocks = [keys[i:i + RANK_BLOCK_SIZE] for i in range(0, len(keys), RANK_BLOCK_SIZE)]
+        self.maxes = [block[-1] for block in self.blocks]
+        self.size = len(keys)
+        self.rebuild_tree()
+
+    def rebuild_tree(self):
+        tree = [0] + [len(block) for block in self.blocks]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def tree_add(self, block, delta):
+        i = block + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def keys_before_block(self, block):
+        total = 0
+        i = block
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def find_block(self, key):
+        block = bisect.bisect_left(self.maxes, key)
+        return block if block < len(self.blocks) else len(self.blocks) - 1
+
+    def insert(self, key):
+        if not self.blocks:
+            self.build([key])
+            return
+        block = self.find_block(key)
+        keys = self.blocks[block]
+        bisect.insort(keys, key)
+        self.maxes[block] = keys[-1]
+        self.size += 1
+        if len(keys) > 2 * RANK_BLOCK_SIZE:
+            self.blocks[block:block + 1] = [keys[:RANK_BLOCK_SIZE], keys[RANK_BLOCK_SIZE:]]
+            self.maxes[block:block + 1] = [keys[RANK_BLOCK_SIZE - 1], keys[-1]]
+            self.rebuild_tree()
+        else:
+            self.tree_add(block, 1)
+
+    def remove(self, key):
+        """Remove a key; returns False if it wasn't there."""
+        if not self.blocks:
+            return False
+        block = self.find_block(key)
+        keys = self.blocks[block]
+        i = bisect.bisect_left(keys, key)
+        if i == len(keys) or keys[i] != key:
+            return False
+        del keys[i]
+        self.size -= 1
+        if keys:
+            self.maxes[block] = keys[-1]
+            self.tree_add(block, -1)
+        else:
+            del self.blocks[block]
+            del self.maxes[block]
+            self.rebuild_tree()
+        return True
+
+    def __contains__(self, key):
+        if not self.blocks:
+            return False
+        keys = self.blocks[self.find_block(key)]
+        i = bisect.bisect_left(keys, key)
+        return i < len(keys) and keys[i] == key
+
+    def count_below(self, key):
+        """How many keys sort before `key`."""
+        if not self.blocks:
+            return 0
+        block = bisect.bisect_left(self.maxes, key)
+        if block == len(self.blocks):
+            return self.size
+        return self.keys_before_block(block) + bisect.bisect_left(self.blocks[block], key)
+
+    def key_at(self, position):
+        """The key at an ascending position, found by walking down the Fenwick tree."""
+        block = 0
+        step = 1 << (len(self.tree).bit_length())
+        while step:
+            nxt = block + step
+            if nxt < len(self.tree) and self.tree[nxt] <= position:
+                block = nxt
+                position -= self.tree[nxt]
+            step >>= 1
+        return self.blocks[block][position]
+
+    def rank(self, score):
+        """1-based rank of a score, best first; players on equal scores share a rank."""
+        return self.size - self.count_below(rank_key(score + 1, 0)) + 1
+
+    def around(self, score, user_id, count=RANK_AROUND):
+        """[(place, user_id, score)] for the player and up to `count` players either side, best first."""
+        position = self.size - 1 - self.count_below(rank_key(score, user_id))
+        first, last = max(0, position - count), min(self.size - 1, position + count)
+        return [(place + 1,) + unpack_rank_key(self.key_at(self.size - 1 - place)) for place in range(first, last + 1)]
+
+    def begin_load(self):
+        self.loaded = False
+        self.loading = True
+        self.pending = {}
+
+    def load(self, rows):
+        """Install (user_id, score) rows, then replay scores seen while they were being read."""
+        if not self.loading:
+            return  # Invalidated while reading
+        self.build(rank_key(score, user_id) for user_id, score in rows if score is not None)
+        self.loaded = True
+        self.loading = False
+        for user_id, scores in self.pending.items():
+            # The read saw at most one of these; drop whichever it was and keep the latest
+            for score in scores[:-1]:
+                if score is not None and self.remove(rank_key(score, user_id)):
+                    break
+            self.update(user_id, None, scores[-1])
+        self.pending = {}
+
+    def invalidate(self):
+        self.loaded = False
+        self.loading = False
+        self.build(())
+
+    def update(self, user_id, previous, score):
+        """Move a player from their previous score to `score` (previous None: add them if missing)."""
+        if self.loading:
+            self.pending.setdefault(user_id, [previous]).append(score)
+            return
+        if not self.loaded or previous == score and previous is not None:
+            return
+        if previous is not None:
+            self.remove(rank_key(previous, user_id))
+        if score is not None:
+            key = rank_key(score, user_id)
+            if previous is not None or key not in self:
+                self.insert(key)
+
+def bench_rank_index(users=1_000_000, ops=100_000):
+    """Time building, updating and querying a RankIndex over `users` random balances."""
+    rng = random.Random(0)
+    balances = {user_id: rng.randint(0, 10 ** 7) for user_id in range(1, users + 1)}
+    index = RankIndex()
+    index.loaded = True
+    start = time.perf_counter()
+    index.build(rank_key(score, user_id) for user_id, score in balances.items())
+    print(f"build {users} users: {time.perf_counter() - start:.2f}s")
+    user_ids = [rng.randint(1, users) for _ in range(ops)]
+    start = time.perf_counter()
+    for user_id in user_ids:
+        score = balances[user_id] + rng.randint(-5000, 5000)
+        index.update(user_id, balances[user_id], score)
+        balances[user_id] = score
+    elapsed = time.perf_counter() - start
+    print(f"{ops} updates: {elapsed:.2f}s ({elapsed / ops * 1e6:.1f} us each)")
+    start = time.perf_counter()
+    for user_id in user_ids:
+        index.rank(balances[user_id])
+    elapsed = time.perf_counter() - start
+    print(f"{ops} rank lookups: {elapsed:.2f}s ({elapsed / ops * 1e6:.1f} us each)")
+    start = time.perf_counter()
+    for user_id in user_ids:
+        index.around(balances[user_id], user_id)
+    elapsed = time.perf_counter() - start
+    print(f"{ops} neighbour lookups: {elapsed:.2f}s ({elapsed / ops * 1e6:.1f} us each)")
+    start = time.perf_counter()
+    for user_id in user_ids[:100]:
+        sum(1 for score in balances.values() if score > balances[user_id])
+    elapsed = time.perf_counter() - start
+    print(f"100 full-scan ranks for comparison: {elapsed:.2f}s ({elapsed / 100 * 1e3:.1f} ms each)")
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["bench-rank"]:
+        bench_rank_index(int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000)
+    elif sys.argv[1:2] == ["bench-poker"]:
+        sys.exit(0 if bench_poker_evaluator(int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000) else 1)
+    elif sys.argv[1:2] == ["simulate"]:
+        simulate_cli(sys.argv[2:])
+    else:
+        sys.exit(f"usage: {sys.argv[0]} bench-rank [users] | bench-poker [hands] | simulate [games...]")
@@ -0,0 +1 @@
+"""Lets the tests under tests/ import casino_engine from the repository root."""
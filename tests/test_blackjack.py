@@ -0,0 +1,72 @@
+"""Blackjack: batch backend parity, table shoes and the dealer-outcome tables."""
+import random
+from array import array
+
+import pytest
+
+from casino_engine import (BLACKJACK_HIT, BLACKJACK_MAX_CARDS, BLACKJACK_PAYOUT, CARD_IDS, DEALER_FINAL_ODDS,
+                           BlackjackHand, BlackjackTable, Shoe, blackjack_batch)
+
+AMOUNT = 100
+RETURNS = {0, AMOUNT, 2 * AMOUNT, AMOUNT + int(AMOUNT * BLACKJACK_PAYOUT)}
+
+
+class InOrder:
+    """A shoe rng that never swaps, so cards come out in the order they were stacked."""
+
+    def randrange(self, start, stop):
+        return start
+
+
+def test_pure_python_batch_is_seeded_and_chunks_join_up():
+    whole = blackjack_batch(400, AMOUNT, seed=9, use_numpy=False)
+    assert whole == blackjack_batch(400, AMOUNT, seed=9, use_numpy=False)
+    tail = blackjack_batch(150, AMOUNT, seed=9, offset=250 * BLACKJACK_MAX_CARDS, use_numpy=False)
+    assert whole[250:] == tail
+    assert set(whole) <= RETURNS
+
+
+@pytest.mark.parametrize('policy', ['basic', 17, 12])
+def test_numpy_and_python_batches_agree(policy):
+    pytest.importorskip("numpy")
+    fast = blackjack_batch(3000, AMOUNT, seed=5, offset=123, policy=policy, use_numpy=True)
+    slow = blackjack_batch(3000, AMOUNT, seed=5, offset=123, policy=policy, use_numpy=False)
+    assert fast.tolist() == slow
+
+
+def test_dealer_odds_are_distributions():
+    for up in range(1, 11):
+        assert sum(DEALER_FINAL_ODDS[up]) == pytest.approx(1.0)
+        assert all(0 <= p <= 1 for p in DEALER_FINAL_ODDS[up])
+
+
+def test_basic_strategy_spot_checks():
+    assert BLACKJACK_HIT[0][16][10]      # Hard 16 hits a ten
+    assert not BLACKJACK_HIT[0][12][4]   # Hard 12 stands on a four
+    assert BLACKJACK_HIT[0][12][2]       # ... but hits a two
+    assert not BLACKJACK_HIT[0][17][1]   # Hard 17 always stands
+    assert BLACKJACK_HIT[1][8][9]        # Soft 18 hits a nine
+    assert not BLACKJACK_HIT[1][8][7]    # ... and stands on a seven
+
+
+def test_hand_tracks_soft_totals():
+    shoe = Shoe(decks=1, penetration=1.0, rng=InOrder())
+    shoe.cards = array('B', [CARD_IDS['A♠'], CARD_IDS['10♥'], CARD_IDS['7♦']])
+    hand = BlackjackHand()
+    hand.deal(shoe, 2)
+    assert (hand.value, hand.natural) == (21, True)
+    hand.deal(shoe)
+    assert (hand.total, hand.soft, hand.value, hand.natural) == (18, True, 18, False)
+
+
+def test_table_only_reshuffles_between_hands():
+    table = BlackjackTable()
+    table.shoe.rng = random.Random(1)
+    shoe = table.open_hand()
+    shoe.draw(table.shoe.cut)
+    table.open_hand()  # A second hand joins while the first is open: no reshuffle under it
+    assert shoe.dealt == shoe.cut
+    table.close_hand()
+    table.close_hand()
+    table.open_hand()
+    assert shoe.dealt == 0
@@ -0,0 +1,62 @@
+"""The integer card shoe: draw counts, the cut card and reshuffles."""
+import random
+from collections import Counter
+
+from casino_engine import CARD_IDS, CARD_NAMES, Shoe, format_cards
+
+
+def test_draw_advances_by_count_and_never_repeats_within_a_deck():
+    shoe = Shoe(decks=1, penetration=1.0, rng=random.Random(1))
+    cards = []
+    for count in (5, 2, 10, 35):
+        hand = shoe.draw(count)
+        assert len(hand) == count
+        cards += hand
+        assert shoe.dealt == len(cards)
+    assert sorted(cards) == list(range(52))
+
+
+def test_same_seed_deals_same_cards():
+    first = Shoe(decks=2, rng=random.Random(42))
+    second = Shoe(decks=2, rng=random.Random(42))
+    assert [first.draw(7) for _ in range(10)] == [second.draw(7) for _ in range(10)]
+
+
+def test_cut_card_reshuffles_at_the_next_hand():
+    shoe = Shoe(decks=1, penetration=0.5, rng=random.Random(3))
+    assert shoe.cut == 26
+    shoe.draw(20)
+    shoe.start_hand()
+    assert shoe.dealt == 20
+    shoe.draw(6)
+    shoe.start_hand()
+    assert shoe.dealt == 0
+
+
+def test_zero_penetration_reshuffles_every_hand():
+    shoe = Shoe(decks=1, rng=random.Random(4))
+    for _ in range(20):
+        shoe.start_hand()
+        assert shoe.dealt == 0
+        shoe.draw(5)
+
+
+def test_running_out_mid_hand_reshuffles_first():
+    shoe = Shoe(decks=1, penetration=1.0, rng=random.Random(5))
+    shoe.draw(50)
+    hand = shoe.draw(5)
+    assert len(set(hand)) == 5
+    assert shoe.dealt == 5
+
+
+def test_reshuffles_keep_every_card_in_the_shoe():
+    shoe = Shoe(decks=4, penetration=0.75, rng=random.Random(6))
+    for _ in range(500):
+        shoe.start_hand()
+        shoe.draw(9)
+    assert Counter(shoe.cards) == {card: 4 for card in range(52)}
+
+
+def test_card_names_round_trip():
+    assert all(CARD_IDS[CARD_NAMES[card]] == card for card in range(52))
+    assert format_cards([CARD_IDS['A♠'], CARD_IDS['10♦']]) == "A♠ 10♦"
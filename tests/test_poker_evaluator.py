@@ -0,0 +1,73 @@
+"""The lookup-table poker evaluator against a direct rank-counting reference."""
+import itertools
+import random
+from collections import Counter
+
+from casino_engine import (CARD_IDS, HAND_CATEGORIES, POKER_HAND_COUNTS, best_hand_value, evaluate_poker_hand,
+                           hand_category, hand_value)
+
+SAMPLE_HANDS = 50_000
+SAMPLE_DEALS = 5_000
+
+
+def reference_key(cards):
+    """(category index, tiebreak ranks) of five distinct card ints, worked out from rank and suit counts."""
+    ranks = [card >> 2 for card in cards]
+    groups = sorted(((count, rank) for rank, count in Counter(ranks).items()), reverse=True)
+    shape = [count for count, _ in groups]
+    order = [rank for _, rank in groups]
+    flush = len({card & 3 for card in cards}) == 1
+    straight = None
+    if len(order) == 5:
+        if order[0] - order[4] == 4:
+            straight = order[0]
+        elif order == [12, 3, 2, 1, 0]:
+            straight = 3  # The wheel plays five-high
+    if straight is not None:
+        category = 'straight_flush' if flush else 'straight'
+        return HAND_CATEGORIES.index(category), [straight]
+    if shape == [4, 1]:
+        category = 'four_of_a_kind'
+    elif shape == [3, 2]:
+        category = 'full_house'
+    elif flush:
+        category = 'flush'
+    elif shape == [3, 1, 1]:
+        category = 'three_of_a_kind'
+    elif shape == [2, 2, 1]:
+        category = 'two_pair'
+    elif shape == [2, 1, 1, 1]:
+        category = 'pair'
+    else:
+        category = 'high_card'
+    return HAND_CATEGORIES.index(category), order
+
+
+def test_every_five_card_hand_lands_in_its_category():
+    counts = Counter(hand_category(hand_value(hand)) for hand in itertools.combinations(range(52), 5))
+    assert counts == POKER_HAND_COUNTS
+
+
+def test_lookup_matches_reference_order_on_sample():
+    rng = random.Random(2024)
+    hands = [rng.sample(range(52), 5) for _ in range(SAMPLE_HANDS)]
+    scored = sorted((hand_value(hand), reference_key(hand)) for hand in hands)
+    for (value, key), (next_value, next_key) in zip(scored, scored[1:]):
+        assert (value < next_value) == (key < next_key)
+        assert (value == next_value) == (key == next_key)
+    for value, key in scored:
+        assert HAND_CATEGORIES.index(hand_category(value)) == key[0]
+
+
+def test_best_hand_value_matches_best_of_every_five_card_subset():
+    rng = random.Random(7)
+    for size in (6, 7):
+        for _ in range(SAMPLE_DEALS):
+            deal = rng.sample(range(52), size)
+            assert best_hand_value(deal) == max(hand_value(five) for five in itertools.combinations(deal, 5))
+
+
+def test_payout_names():
+    assert evaluate_poker_hand([CARD_IDS[name] for name in ('10♥', 'J♥', 'Q♥', 'K♥', 'A♥')]) == 'royal_flush'
+    assert evaluate_poker_hand([CARD_IDS[name] for name in ('J♠', 'J♦', '2♣', '5♥', '9♠')]) == 'pair'
+    assert evaluate_poker_hand([CARD_IDS[name] for name in ('10♠', '10♦', '2♣', '5♥', '9♠')]) == 'high_card'
@@ -0,0 +1,33 @@
+"""The offline Monte Carlo simulator: seeded runs reproduce regardless of worker count."""
+import csv
+
+from casino_engine import SIM_FIELDS, SIM_GAMES, simulate_cli, simulate_games
+
+ROUNDS = 2_000
+CHUNK = 500
+
+
+def test_seeded_run_does_not_depend_on_workers():
+    serial = simulate_games(SIM_GAMES, ROUNDS, seed=11, workers=1, chunk=CHUNK)
+    pooled = simulate_games(SIM_GAMES, ROUNDS, seed=11, workers=2, chunk=CHUNK)
+    assert serial == pooled
+    assert [report['game'] for report in serial] == list(SIM_GAMES)
+    assert simulate_games(('roulette',), ROUNDS, seed=12, workers=1, chunk=CHUNK) != serial[1:2]
+
+
+def test_reports_are_consistent():
+    for report in simulate_games(SIM_GAMES, ROUNDS, seed=5, workers=1, chunk=CHUNK):
+        assert report['rounds'] == ROUNDS
+        assert report['ci_low'] <= report['rtp'] <= report['ci_high']
+        assert report['house_edge'] == 1 - report['rtp']
+        assert 0 <= report['hit_frequency'] <= 1
+
+
+def test_cli_writes_csv(tmp_path):
+    path = tmp_path / "rtp.csv"
+    simulate_cli(['roulette', 'craps', '--rounds', str(ROUNDS), '--seed', '3', '--workers', '1',
+                  '--format', 'csv', '--output', str(path)])
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['game'] for row in rows] == ['roulette', 'craps']
+    assert list(rows[0]) == list(SIM_FIELDS)
@@ -0,0 +1,44 @@
+"""The batch slot engine: SplitMix64 stream, backend parity and scoring."""
+import pytest
+
+from casino_engine import (JACKPOT_INDEX, JACKPOT_MULTIPLIER, MASK64, SLOT_LINE_PAYOUT, SLOTS, SPLITMIX_GAMMA,
+                           evaluate_slots, slot_stops, spin_batch, splitmix64)
+
+
+def test_splitmix64_matches_reference_output():
+    # First output of the reference SplitMix64 generator seeded with 0
+    assert splitmix64(SPLITMIX_GAMMA) == 0xE220A8397B1DCDAF
+
+
+def test_pure_python_stops_are_fixed_for_a_seed():
+    assert slot_stops(2, 3, 1, use_numpy=False) == [[[3, 4, 5], [2, 2, 4], [5, 3, 1]],
+                                                    [[4, 2, 3], [2, 3, 2], [1, 3, 4]]]
+    assert sum(spin_batch(2000, 3, 1, use_numpy=False).payouts) == 28100
+
+
+def test_stream_chunks_join_up():
+    whole = slot_stops(40, 2, 99, use_numpy=False)
+    assert slot_stops(15, 2, 99, use_numpy=False) + slot_stops(25, 2, 99, offset=15 * 2 * 3, use_numpy=False) == whole
+    assert all(0 <= stop < len(SLOTS) for spin in whole for line in spin for stop in line)
+
+
+def test_numpy_and_python_backends_agree():
+    np = pytest.importorskip("numpy")
+    from casino_engine import splitmix64_array
+    seed = 0x123456789ABCDEF0
+    positions = np.arange(1000, 1500, dtype=np.uint64)
+    assert splitmix64_array(seed, positions).tolist() == [
+        splitmix64((seed + (int(p) + 1) * SPLITMIX_GAMMA) & MASK64) for p in positions]
+    assert slot_stops(300, 3, seed, offset=7, use_numpy=True).tolist() == slot_stops(300, 3, seed, offset=7, use_numpy=False)
+    fast = spin_batch(5000, 2, seed, use_numpy=True)
+    slow = spin_batch(5000, 2, seed, use_numpy=False)
+    assert fast.payouts.tolist() == slow.payouts
+    assert fast.jackpots.tolist() == slow.jackpots
+
+
+def test_evaluate_slots_pays_matching_lines():
+    other = (JACKPOT_INDEX + 1) % len(SLOTS)
+    batch = evaluate_slots([[[JACKPOT_INDEX] * 3, [other] * 3, [other, other, JACKPOT_INDEX]]])
+    assert batch.line_wins == [[SLOT_LINE_PAYOUT * JACKPOT_MULTIPLIER, SLOT_LINE_PAYOUT, 0]]
+    assert batch.payouts == [SLOT_LINE_PAYOUT * (JACKPOT_MULTIPLIER + 1)]
+    assert batch.jackpots == [True]